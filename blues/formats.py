@@ -3,17 +3,21 @@ import logging
 import subprocess
 
 import mdtraj.version
-import netCDF4 as nc
 import numpy as np
 import parmed
 import simtk.openmm.version
-import yaml
 from mdtraj.formats.hdf5 import HDF5TrajectoryFile
 from mdtraj.utils import ensure_type, in_units_of
+from parmed import unit as u
 from parmed.amber.netcdffiles import NetCDFTraj
 
 from blues import reporters
 
+# netCDF4 is only needed by NetCDF4Traj; it is imported on first use so
+# that callers which only want the logging/HDF5 pieces of this module do
+# not pay its import cost.
+nc = None
+
 
 ######################
 #  REPORTER FORMATS  #
@@ -103,8 +107,17 @@ class BLUESHDF5TrajectoryFile(HDF5TrajectoryFile):
 
     """
 
+    #Every field write() knows how to store, in file order
+    _FIELDS = ('coordinates', 'time', 'cell_lengths', 'cell_angles', 'velocities', 'kineticEnergy', 'potentialEnergy',
+               'temperature', 'protocolWork', 'alchemicalLambda')
+
     def __init__(self, filename, mode='r', force_overwrite=True, compression='zlib'):
         super(BLUESHDF5TrajectoryFile, self).__init__(filename, mode, force_overwrite, compression)
+        #The set of fields present in the file, fixed once the headers are
+        # created (or probed once when appending to an existing file). The
+        # fast path in write() checks incoming frames against this instead
+        # of probing the node tree per field per frame.
+        self._present_fields = None
 
     def write(self,
               coordinates,
@@ -199,6 +212,76 @@ class BLUESHDF5TrajectoryFile(HDF5TrajectoryFile):
         alchemicalLambda = in_units_of(alchemicalLambda, None, 'dimensionless')
         protocolWork = in_units_of(protocolWork, None, 'kT')
 
+        # Steady-state fast path: after the first frame the dtype, shape and
+        # set of fields in the file are fixed (we refuse 'ragged' arrays), so
+        # the per-field ensure_type validation below is pure overhead. Hand
+        # contiguous float32 buffers straight to the chunked EArray appends,
+        # which keeps the HDF5 filter pipeline fed with whole aligned chunks.
+        # PyTables exposes no H5DOwrite_chunk-style precompressed write, so
+        # this is as close as this backend gets to a direct chunk write.
+        if not self._needs_initialization:
+            #When appending to a file whose headers were written in an
+            # earlier session, probe the node tree once for the fields it
+            # actually contains; _initialize_headers fills this in directly
+            # for files created here.
+            if self._present_fields is None:
+                present = set()
+                for name in self._FIELDS:
+                    try:
+                        self._get_node(where='/', name=name)
+                    except self.tables.NoSuchNodeError:
+                        continue
+                    present.add(name)
+                self._present_fields = frozenset(present)
+            coordinates = np.ascontiguousarray(coordinates, dtype=np.float32)
+            if coordinates.ndim == 2:
+                coordinates = coordinates[np.newaxis]
+            n_frames, n_atoms = coordinates.shape[0:2]
+            #Validate every field before appending anything, so a bad call
+            # cannot leave some arrays in the file longer than others.
+            fields = []
+            for name, contents, ndim in (('time', time, 1), ('cell_lengths', cell_lengths, 2),
+                                         ('cell_angles', cell_angles, 2), ('velocities', velocities, 3),
+                                         ('kineticEnergy', kineticEnergy, 1), ('potentialEnergy', potentialEnergy, 1),
+                                         ('temperature', temperature, 1), ('protocolWork', protocolWork, 1),
+                                         ('alchemicalLambda', alchemicalLambda, 1)):
+                #Enforce the same no-'ragged'-arrays contract as the slow
+                # path below: every frame must carry exactly the fields the
+                # file was created with.
+                if contents is None:
+                    if name in self._present_fields:
+                        raise ValueError("The file that you're saving to expects each frame "
+                                         "to contain %s information, but you did not supply it."
+                                         "I don't allow 'ragged' arrays. If one frame is going "
+                                         "to have %s information, then I expect all of them to. " % (name, name))
+                    continue
+                if name not in self._present_fields:
+                    raise ValueError("The file that you're trying to save to doesn't "
+                                     "contain the field %s. You can always save a new trajectory "
+                                     "and have it contain this information, but I don't allow 'ragged' "
+                                     "arrays. If one frame is going to have %s information, then I expect "
+                                     "all of them to. So I can't save it for just these frames. Sorry "
+                                     "about that :)" % (name, name))
+                contents = np.ascontiguousarray(contents, dtype=np.float32)
+                if contents.ndim < ndim:
+                    contents = contents[np.newaxis]
+                #Cheap stand-in for the slow path's ensure_type shape checks:
+                # every field must cover exactly the frames (and atoms) that
+                # the coordinates do, or the arrays in the file desynchronize.
+                if contents.shape[0] != n_frames:
+                    raise ValueError('%s contains %d frames, but coordinates contains %d frames. '
+                                     'Every field must be written with the same number of frames.' %
+                                     (name, contents.shape[0], n_frames))
+                if ndim == 3 and contents.shape[1] != n_atoms:
+                    raise ValueError('%s contains %d atoms, but coordinates contains %d atoms.' %
+                                     (name, contents.shape[1], n_atoms))
+                fields.append((name, contents))
+            self._get_node(where='/', name='coordinates').append(coordinates)
+            for name, contents in fields:
+                self._get_node(where='/', name=name).append(contents)
+            self._frame_index += n_frames
+            return
+
         # do typechecking and shapechecking on the arrays
         # this ensure_type method has a lot of options, but basically it lets
         # us validate most aspects of the array. Also, we can upconvert
@@ -353,8 +436,9 @@ class BLUESHDF5TrajectoryFile(HDF5TrajectoryFile):
                              "I don't allow 'ragged' arrays. If one frame is going "
                              "to have %s information, then I expect all of them to. " % (name, name))
 
+        # Flushing is left to the caller (see BLUESHDF5Reporter), so that
+        # frames can accumulate in the HDF5 chunk cache between flushes.
         self._frame_index += n_frames
-        self.flush()
 
     def _encodeStringForPyTables(self, string, name, where='/', complevel=1, complib='zlib', shuffle=True):
         """
@@ -401,8 +485,31 @@ class BLUESHDF5TrajectoryFile(HDF5TrajectoryFile):
             will be written to the HDF5 file.
 
         """
+        import blues
         self._n_atoms = n_atoms
         self._parameters = parameters
+        #Record which frame-level fields this file will contain; the fast
+        # path in write() validates later frames against this set.
+        present = set()
+        if set_coordinates:
+            present.add('coordinates')
+        if set_time:
+            present.add('time')
+        if set_cell:
+            present.update(('cell_lengths', 'cell_angles'))
+        if set_velocities:
+            present.add('velocities')
+        if set_kineticEnergy:
+            present.add('kineticEnergy')
+        if set_potentialEnergy:
+            present.add('potentialEnergy')
+        if set_temperature:
+            present.add('temperature')
+        if set_alchemicalLambda:
+            present.add('alchemicalLambda')
+        if set_protocolWork:
+            present.add('protocolWork')
+        self._present_fields = frozenset(present)
         self._handle.root._v_attrs.title = str(title)
         self._handle.root._v_attrs.conventions = str('Pande')
         self._handle.root._v_attrs.conventionVersion = str('1.1')
@@ -465,6 +572,7 @@ class BLUESHDF5TrajectoryFile(HDF5TrajectoryFile):
 
         if set_environment:
             try:
+                import yaml
                 envout = subprocess.check_output('conda env export --no-builds', shell=True, stderr=subprocess.STDOUT)
                 envjson = json.dumps(yaml.load(envout), sort_keys=True, indent=2)
                 self._encodeStringForPyTables(envjson, name='environment')
@@ -488,6 +596,9 @@ class NetCDF4Traj(NetCDFTraj):
     """
 
     def __init__(self, fname, mode='r'):
+        global nc
+        if nc is None:
+            import netCDF4 as nc
         super(NetCDF4Traj, self).__init__(fname, mode)
 
     def flush(self):
@@ -512,7 +623,10 @@ class NetCDF4Traj(NetCDFTraj):
                  remd_dimension=None,
                  title='',
                  protocolWork=False,
-                 alchemicalLambda=False):
+                 alchemicalLambda=False,
+                 complevel=4,
+                 chunk_frames=1,
+                 shuffle=True):
         """Opens a new NetCDF file and sets the attributes
 
         Parameters
@@ -543,6 +657,20 @@ class NetCDF4Traj(NetCDFTraj):
         alchemicalLambda : bool, default=False
             Indicates if alchemicalLambda from the NCMC simulation should be written
             to the NetCDF file
+        complevel : int, default=4
+            The zlib deflate level for the per-atom variables (coordinates,
+            velocities, forces). 0 disables compression and falls back to
+            the default contiguous layout. Compression and chunking are only
+            applied when the underlying file uses the NETCDF4 data model;
+            classic-model (NETCDF3) files and parmed's pure-Python backend
+            do not support them and keep the default layout.
+        chunk_frames : int, default=1
+            The number of frames per HDF5 chunk for the per-atom variables.
+            Set this to the write batch size so each write fills exactly one
+            chunk and partial-chunk rewrites are avoided.
+        shuffle : bool, default=True
+            Whether to apply the byte-shuffle filter before deflating, which
+            usually improves the compression ratio of float data.
 
         """
         inst = cls(fname, 'w')
@@ -587,6 +715,18 @@ class NetCDF4Traj(NetCDFTraj):
         if inst.remd == 'MULTI':
             ncfile.createDimension('remd_dimension', inst.remd_dimension)
         inst.frame, inst.spatial, inst.atom = None, 3, natom
+        # Chunking/deflate options for the large per-atom variables. The
+        # default contiguous layout makes readers (and compressed writes)
+        # far slower than frame-aligned chunks. These createVariable
+        # keywords only have an effect on the netCDF4 backend with an
+        # HDF5-based (NETCDF4 data model) file: parmed's pure-Python
+        # fallback backend accepts no keyword arguments at all, and netCDF4
+        # silently ignores them for classic-model (NETCDF3) files, so only
+        # build them when the handle actually supports them.
+        compression = {}
+        if complevel and getattr(ncfile, 'data_model', '') == 'NETCDF4':
+            compression = {'zlib': True, 'complevel': int(complevel), 'shuffle': bool(shuffle)}
+            compression['chunksizes'] = (int(chunk_frames), natom, 3)
         if inst.hasbox:
             ncfile.createDimension('cell_spatial', 3)
             ncfile.createDimension('cell_angular', 3)
@@ -606,18 +746,18 @@ class NetCDF4Traj(NetCDFTraj):
         v = ncfile.createVariable('time', 'f', ('frame', ))
         v.units = 'picosecond'
         if inst.hascrds:
-            v = ncfile.createVariable('coordinates', 'f', ('frame', 'atom', 'spatial'))
+            v = ncfile.createVariable('coordinates', 'f', ('frame', 'atom', 'spatial'), **compression)
             v.units = 'angstrom'
             inst._last_crd_frame = 0
         if inst.hasvels:
-            v = ncfile.createVariable('velocities', 'f', ('frame', 'atom', 'spatial'))
+            v = ncfile.createVariable('velocities', 'f', ('frame', 'atom', 'spatial'), **compression)
             v.units = 'angstrom/picosecond'
             inst.velocity_scale = v.scale_factor = 20.455
             inst._last_vel_frame = 0
             if nc is not None:
                 v.set_auto_maskandscale(False)
         if inst.hasfrcs:
-            v = ncfile.createVariable('forces', 'f', ('frame', 'atom', 'spatial'))
+            v = ncfile.createVariable('forces', 'f', ('frame', 'atom', 'spatial'), **compression)
             v.units = 'kilocalorie/mole/angstrom'
             inst._last_frc_frame = 0
         if inst.hasbox:
@@ -647,8 +787,101 @@ class NetCDF4Traj(NetCDFTraj):
             v.units = 'unitless'
             inst._last_alchemicalLambda_frame = 0
 
+        # Materialize the header in one metadata flush now that every
+        # dimension, variable and attribute has been defined. Nothing
+        # touches the metadata after this point, so data writes never
+        # force the header back out to disk.
+        inst.flush()
+
         return inst
 
+    def add_frames(self,
+                   crds=None,
+                   vels=None,
+                   frcs=None,
+                   cell_lengths=None,
+                   cell_angles=None,
+                   times=None,
+                   protocolWork=None,
+                   alchemicalLambda=None):
+        """ Adds a batch of frames to the NetCDF file
+
+        Each variable is written with a single slice assignment, so a batch
+        sized to the variable's chunk length turns into one contiguous
+        NetCDF write instead of per-frame writes and metadata updates.
+
+        Parameters
+        ----------
+        crds : np.ndarray, shape=(n_frames, natom, 3), optional
+            The coordinates, in angstroms
+        vels : np.ndarray, shape=(n_frames, natom, 3), optional
+            The velocities, in angstroms/picosecond (scaled on write)
+        frcs : np.ndarray, shape=(n_frames, natom, 3), optional
+            The forces, in kilocalories/mole/angstrom
+        cell_lengths : np.ndarray, shape=(n_frames, 3), optional
+            The unit cell lengths, in angstroms
+        cell_angles : np.ndarray, shape=(n_frames, 3), optional
+            The unit cell angles, in degrees
+        times : np.ndarray, shape=(n_frames,), optional
+            The time of each frame, in picoseconds
+        protocolWork : np.ndarray, shape=(n_frames,), optional
+            The NCMC protocol work of each frame, in kT
+        alchemicalLambda : np.ndarray, shape=(n_frames,), optional
+            The NCMC alchemical lambda of each frame
+
+        """
+        var = self._ncfile.variables
+        if crds is not None:
+            n = len(crds)
+            var['coordinates'][self._last_crd_frame:self._last_crd_frame + n, :, :] = crds
+            self._last_crd_frame += n
+        if vels is not None:
+            n = len(vels)
+            # The velocities get scaled right before writing
+            var['velocities'][self._last_vel_frame:self._last_vel_frame + n, :, :] = \
+                np.asarray(vels) / self.velocity_scale
+            self._last_vel_frame += n
+        if frcs is not None:
+            n = len(frcs)
+            var['forces'][self._last_frc_frame:self._last_frc_frame + n, :, :] = frcs
+            self._last_frc_frame += n
+        if cell_lengths is not None:
+            n = len(cell_lengths)
+            var['cell_lengths'][self._last_box_frame:self._last_box_frame + n, :] = cell_lengths
+            var['cell_angles'][self._last_box_frame:self._last_box_frame + n, :] = cell_angles
+            self._last_box_frame += n
+        if times is not None:
+            n = len(times)
+            var['time'][self._last_time_frame:self._last_time_frame + n] = times
+            self._last_time_frame += n
+        if protocolWork is not None:
+            n = len(protocolWork)
+            var['protocolWork'][self._last_protocolWork_frame:self._last_protocolWork_frame + n] = protocolWork
+            self._last_protocolWork_frame += n
+        if alchemicalLambda is not None:
+            n = len(alchemicalLambda)
+            var['alchemicalLambda'][self._last_alchemicalLambda_frame:self._last_alchemicalLambda_frame +
+                                    n] = alchemicalLambda
+            self._last_alchemicalLambda_frame += n
+        self.flush()
+
+    def add_coordinates(self, stuff):
+        """ Adds the coordinates to the current frame of the NetCDF file
+
+        Parameters
+        ----------
+        stuff : np.ndarray or distance Quantity, shape=(natom, 3)
+            The coordinates, in angstroms, to add to the current frame
+
+        """
+        if u.is_quantity(stuff):
+            stuff = stuff.value_in_unit(u.angstroms)
+        # Assign the whole frame in one C-level cast/copy rather than letting
+        # the base class iterate over a Python list of coordinates.
+        stuff = np.asarray(stuff, dtype=np.float32)
+        self._ncfile.variables['coordinates'][self._last_crd_frame, :, :] = stuff.reshape(self.atom, 3)
+        self._last_crd_frame += 1
+
     @property
     def protocolWork(self):
         """
@@ -665,9 +898,10 @@ class NetCDF4Traj(NetCDFTraj):
             The time to add to the current frame
         """
         #if u.is_quantity(stuff): stuff = stuff.value_in_unit(u.picoseconds)
+        # Flushing is left to the caller (see add_frames), so scalar writes
+        # do not each force a sync round-trip.
         self._ncfile.variables['protocolWork'][self._last_protocolWork_frame] = float(stuff)
         self._last_protocolWork_frame += 1
-        self.flush()
 
     @property
     def alchemicalLambda(self):
@@ -687,4 +921,3 @@ class NetCDF4Traj(NetCDFTraj):
         #if u.is_quantity(stuff): stuff = stuff.value_in_unit(u.picoseconds)
         self._ncfile.variables['alchemicalLambda'][self._last_alchemicalLambda_frame] = float(stuff)
         self._last_alchemicalLambda_frame += 1
-        self.flush()
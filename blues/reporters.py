@@ -1,6 +1,11 @@
+import atexit
 import logging
+import queue
 import sys
+import threading
 import time
+import weakref
+from logging.handlers import QueueHandler, QueueListener
 
 import numpy as np
 import parmed
@@ -11,10 +16,12 @@ from parmed import unit as u
 from parmed.geometry import box_vectors_to_lengths_and_angles
 from simtk.openmm import app
 
-import blues._version
-import blues.reporters
 from blues.formats import *
 
+#Module-level alias so methods whose signatures take a `time` boolean
+# (e.g. BLUESHDF5Reporter.__init__) can still read the monotonic clock.
+_monotonic = time.monotonic
+
 
 def _check_mode(m, modes):
     """
@@ -24,6 +31,63 @@ def _check_mode(m, modes):
         raise ValueError('This operation is only available when a file ' 'is open in mode="%s".' % m)
 
 
+def _register_atexit_close(reporter):
+    """
+    Close `reporter` at interpreter exit without keeping it alive.
+
+    A plain `atexit.register(reporter.close)` would hold a strong reference
+    to every reporter for the life of the process, so `__del__` could never
+    run. Going through a weakref keeps the reporter collectible while still
+    guaranteeing a final flush/close at exit; the returned hook can be given
+    to `atexit.unregister` once the reporter is closed explicitly.
+    """
+    ref = weakref.ref(reporter)
+
+    def _close():
+        reporter = ref()
+        if reporter is not None:
+            try:
+                reporter.close()
+            except Exception:
+                logging.getLogger(__name__).exception('Error closing trajectory reporter at exit')
+
+    atexit.register(_close)
+    return _close
+
+
+def _lambda_index(integrator):
+    """
+    Find the index of the 'lambda' global variable on an NCMC integrator.
+
+    Looking the index up once lets reporters call
+    `integrator.getGlobalVariable(index)` on the hot path, which skips the
+    per-call name lookup done by `getGlobalVariableByName`.
+    """
+    for idx in range(integrator.getNumGlobalVariables()):
+        if integrator.getGlobalVariableName(idx) == 'lambda':
+            return idx
+    return None
+
+
+def _fetch_alch_state(integrator, lambda_idx=None, protocolWork=True, alchemicalLambda=True):
+    """
+    Fetch the protocol work and alchemical lambda from an NCMC integrator
+    as a `(protocolWork, alchemicalLambda)` tuple, in one pass.
+
+    Grouping the queries here keeps each reporter down to a single round of
+    Python<->C++ calls per report; entries for disabled quantities are None.
+    """
+    protocol_work = alchemical_lambda = None
+    if protocolWork:
+        protocol_work = integrator.get_protocol_work(dimensionless=True)
+    if alchemicalLambda:
+        if lambda_idx is not None:
+            alchemical_lambda = integrator.getGlobalVariable(lambda_idx)
+        else:
+            alchemical_lambda = integrator.getGlobalVariableByName('lambda')
+    return protocol_work, alchemical_lambda
+
+
 def addLoggingLevel(levelName, levelNum, methodName=None):
     """
     Comprehensively adds a new logging level to the `logging` module and the
@@ -62,12 +126,18 @@ def addLoggingLevel(levelName, levelNum, methodName=None):
     if not methodName:
         methodName = levelName.lower()
 
-    if hasattr(logging, levelName):
-        logging.warn('{} already defined in logging module'.format(levelName))
-    if hasattr(logging, methodName):
-        logging.warn('{} already defined in logging module'.format(methodName))
-    if hasattr(logging.getLoggerClass(), methodName):
-        logging.warn('{} already defined in logger class'.format(methodName))
+    #A single pass over the module/class dicts instead of repeated hasattr
+    # probes; re-registering the exact same level (e.g. LoggerFormatter is
+    # instantiated more than once) is a harmless no-op.
+    log_attrs = vars(logging)
+    if log_attrs.get(levelName) == levelNum and methodName in log_attrs:
+        return
+    if levelName in log_attrs:
+        logging.warning('{} already defined in logging module'.format(levelName))
+    if methodName in log_attrs:
+        logging.warning('{} already defined in logging module'.format(methodName))
+    if methodName in vars(logging.getLoggerClass()):
+        logging.warning('{} already defined in logger class'.format(methodName))
 
     # This method was inspired by the answers to Stack Overflow post
     # http://stackoverflow.com/q/2183233/2988730, especially
@@ -104,21 +174,35 @@ def init_logger(logger, level=logging.INFO, stream=True, outfname=time.strftime(
     Returns
     -------
     logger : logging.getLogger()
-        The logging object with additional Handlers added.
+        The logging object with additional Handlers added. The logger only
+        enqueues records; a background `logging.handlers.QueueListener`
+        (stored on `logger._blues_queue_listener`) owns the stream/file
+        handlers, so logging calls from the simulation hot loop never block
+        on terminal or disk I/O.
     """
     fmt = LoggerFormatter()
 
+    handlers = []
     if stream:
         # Stream to terminal
         stdout_handler = logging.StreamHandler(stream=sys.stdout)
         stdout_handler.setFormatter(fmt)
-        logger.addHandler(stdout_handler)
+        handlers.append(stdout_handler)
 
     # Write to File
     if outfname:
         fh = logging.FileHandler(outfname + '.log')
         fh.setFormatter(fmt)
-        logger.addHandler(fh)
+        handlers.append(fh)
+
+    # Route records through a queue so the calling thread never performs
+    # blocking I/O; the listener drains the queue on a background thread.
+    log_queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger._blues_queue_listener = listener
 
     logger.addHandler(logging.NullHandler())
     logger.setLevel(level)
@@ -176,6 +260,22 @@ class ReporterConfig:
 
     """
 
+    #Maps reporter keys from the YAML configuration to factory callables
+    # taking (outfname, reporter_kwargs, logger). Add an entry here to
+    # register a new reporter type.
+    _REPORTER_FACTORIES = {
+        'state':
+        lambda outfname, cfg, logger: parmed.openmm.reporters.StateDataReporter(outfname + '.ene', **cfg),
+        'traj_netcdf':
+        lambda outfname, cfg, logger: NetCDF4Reporter(outfname + '.nc', **cfg),
+        'restart':
+        lambda outfname, cfg, logger: parmed.openmm.reporters.RestartReporter(outfname + '.rst7', netcdf=True, **cfg),
+        'progress':
+        lambda outfname, cfg, logger: parmed.openmm.reporters.ProgressReporter(outfname + '.prog', **cfg),
+        'stream':
+        lambda outfname, cfg, logger: BLUESStateDataReporter(logger, **cfg),
+    }
+
     def __init__(self, outfname, reporter_config, logger=None):
 
         self._outfname = outfname
@@ -189,55 +289,22 @@ class ReporterConfig:
         initialization of the class.
         """
         Reporters = []
-        if 'state' in self._cfg.keys():
+        for key, factory in self._REPORTER_FACTORIES.items():
+            if key not in self._cfg:
+                continue
+            cfg = self._cfg[key]
 
-            #Use outfname specified for reporter
-            if 'outfname' in self._cfg['state']:
-                outfname = self._cfg['state']['outfname']
-            else:  #Default to top level outfname
-                outfname = self._outfname
-
-            state = parmed.openmm.reporters.StateDataReporter(outfname + '.ene', **self._cfg['state'])
-            Reporters.append(state)
-
-        if 'traj_netcdf' in self._cfg.keys():
-
-            if 'outfname' in self._cfg['traj_netcdf']:
-                outfname = self._cfg['traj_netcdf']['outfname']
-            else:
-                outfname = self._outfname
+            #Use outfname specified for reporter, else the top level one
+            outfname = cfg.get('outfname', self._outfname)
 
             #Store as an attribute for calculating time/frame
-            if 'reportInterval' in self._cfg['traj_netcdf'].keys():
-                self.trajectory_interval = self._cfg['traj_netcdf']['reportInterval']
-
-            traj_netcdf = NetCDF4Reporter(outfname + '.nc', **self._cfg['traj_netcdf'])
-            Reporters.append(traj_netcdf)
-
-        if 'restart' in self._cfg.keys():
-
-            if 'outfname' in self._cfg['restart']:
-                outfname = self._cfg['restart']['outfname']
-            else:
-                outfname = self._outfname
-
-            restart = parmed.openmm.reporters.RestartReporter(outfname + '.rst7', netcdf=True, **self._cfg['restart'])
-            Reporters.append(restart)
-
-        if 'progress' in self._cfg.keys():
-
-            if 'outfname' in self._cfg['progress']:
-                outfname = self._cfg['progress']['outfname']
-            else:
-                outfname = self._outfname
+            if key == 'traj_netcdf' and 'reportInterval' in cfg:
+                self.trajectory_interval = cfg['reportInterval']
 
-            progress = parmed.openmm.reporters.ProgressReporter(outfname + '.prog', **self._cfg['progress'])
-            Reporters.append(progress)
+            if key == 'stream' and not self._logger:
+                self._logger = logging.getLogger(__name__)
 
-        if 'stream' in self._cfg.keys():
-            if not self._logger: self._logger = logging.getLogger(__name__)
-            stream = blues.reporters.BLUESStateDataReporter(self._logger, **self._cfg['stream'])
-            Reporters.append(stream)
+            Reporters.append(factory(outfname, cfg, self._logger))
 
         return Reporters
 
@@ -294,6 +361,18 @@ class BLUESHDF5Reporter(HDF5Reporter):
     environment : bool
         True will attempt to export your conda environment to JSON and
         store the information in the HDF5 file. Useful for record keeping.
+    constantBox : bool, default=False
+        Set to True when the ensemble keeps the box fixed (NVT/NVE, no
+        barostat). The box vectors are then queried and converted once and
+        the cached cell lengths/angles are reused on every later report,
+        skipping a State query and the trig-heavy conversion per frame.
+    flush_interval : int, default=10
+        The number of reports to accumulate in the HDF5 chunk cache before
+        flushing the file to disk. Flushing on every report forces a disk
+        round-trip per frame, which can dominate the reporter wall time on
+        GPU-driven runs. Data is also flushed whenever more than 5 seconds
+        have passed since the last flush, and at interpreter exit, so at
+        most the last few seconds of frames are at risk on a crash.
 
     Notes
     -----
@@ -305,6 +384,11 @@ class BLUESHDF5Reporter(HDF5Reporter):
 
     """
 
+    #Maximum seconds between flushes, regardless of flush_interval
+    _flush_timeout = 5.0
+    #Sentinel pushed onto the write queue to shut down the writer thread
+    _SENTINEL = object()
+
     @property
     def backend(self):
         return BLUESHDF5TrajectoryFile
@@ -325,22 +409,70 @@ class BLUESHDF5Reporter(HDF5Reporter):
                  protocolWork=True,
                  alchemicalLambda=True,
                  parameters=None,
-                 environment=True):
+                 environment=True,
+                 constantBox=False,
+                 flush_interval=10):
 
         super(BLUESHDF5Reporter, self).__init__(file, reportInterval, coordinates, time, cell, potentialEnergy,
                                                 kineticEnergy, temperature, velocities, atomSubset)
         self._protocolWork = bool(protocolWork)
         self._alchemicalLambda = bool(alchemicalLambda)
 
+        self._flush_interval = int(flush_interval)
+        self._since_flush = 0
+        self._last_flush = _monotonic()
+        self._lambda_idx = None
+        self.constantBox = bool(constantBox)
+        self._cached_cell_lengths = None
+        self._cached_cell_angles = None
+
+        #Background writer thread: report() only builds the snapshot and
+        # enqueues it, so the simulation does not stall on HDF5 compression
+        # and disk writes. The bounded queue applies backpressure if the
+        # disk cannot keep up, instead of growing without limit.
+        self._q = queue.Queue(maxsize=16)
+        self._write_exc = None
+        self._writer = threading.Thread(target=self._write_worker, daemon=True)
+        self._writer.start()
+        #Preserve the crash-safety guarantee of flushing every report by
+        # making sure any buffered frames hit the disk at interpreter exit.
+        self._atexit_hook = _register_atexit_close(self)
+
         self._environment = bool(environment)
         self._title = title
         self._parameters = parameters
 
-        self.frame_indices = frame_indices
-        if self.frame_indices:
-            #If simulation.currentStep = 1, store the frame from the previous step.
-            # i.e. frame_indices=[1,100] will store the first and frame 100
-            self.frame_indices = [x - 1 for x in frame_indices]
+        #If simulation.currentStep = 1, store the frame from the previous step.
+        # i.e. frame_indices=[1,100] will store the first and frame 100
+        #A frozenset keeps the per-step membership test in
+        # describeNextReport O(1) instead of a linear scan of a list.
+        self.frame_indices = frozenset(x - 1 for x in frame_indices)
+
+    def _initialize(self, simulation):
+        super(BLUESHDF5Reporter, self)._initialize(simulation)
+        #Cache the integrator's 'lambda' variable index so that report() can
+        # skip the per-call name lookup done by getGlobalVariableByName.
+        if self._alchemicalLambda:
+            self._lambda_idx = _lambda_index(simulation.integrator)
+        #Hoist the attribute-chain lookups off the per-frame path.
+        self._dist_unit = getattr(unit, self._traj_file.distance_unit)
+        self._box_fn = unitcell.box_vectors_to_lengths_and_angles
+        #Small buffers reused by the writer thread to box the
+        # protocolWork/alchemicalLambda scalars and the cell tuples,
+        # instead of allocating fresh arrays on every report.
+        self._pw_buf = np.empty(1)
+        self._al_buf = np.empty(1)
+        self._cl_buf = np.empty(3)
+        self._ca_buf = np.empty(3)
+        #Precompute 2/(dof*R) as a plain float so the per-frame temperature
+        # is simple float math instead of OpenMM Quantity algebra.
+        if self._temperature:
+            self._temp_prefactor = 2.0 / (
+                self._dof * unit.MOLAR_GAS_CONSTANT_R.value_in_unit(unit.kilojoules_per_mole / unit.kelvin))
+        #An ndarray subset index makes the per-frame fancy-indexing a single
+        # C-level gather instead of converting the Python list every report.
+        if not isinstance(self._atomSlice, slice):
+            self._atomSlice = np.asarray(self._atomSlice, dtype=np.intp)
 
     def describeNextReport(self, simulation):
         """
@@ -391,31 +523,47 @@ class BLUESHDF5Reporter(HDF5Reporter):
         kwargs = {}
         if self._coordinates:
             coordinates = state.getPositions(asNumpy=True)[self._atomSlice]
-            coordinates = coordinates.value_in_unit(getattr(unit, self._traj_file.distance_unit))
+            coordinates = coordinates.value_in_unit(self._dist_unit)
             args = (coordinates, )
         if self._time:
             kwargs['time'] = state.getTime()
         if self._cell:
-            vectors = state.getPeriodicBoxVectors(asNumpy=True)
-            vectors = vectors.value_in_unit(getattr(unit, self._traj_file.distance_unit))
-            a, b, c, alpha, beta, gamma = unitcell.box_vectors_to_lengths_and_angles(*vectors)
-            kwargs['cell_lengths'] = np.array([a, b, c])
-            kwargs['cell_angles'] = np.array([alpha, beta, gamma])
+            if self.constantBox and self._cached_cell_lengths is not None:
+                #Fixed box (NVT/NVE): reuse the converted values from the
+                # first report instead of re-querying the State every frame.
+                kwargs['cell_lengths'] = self._cached_cell_lengths
+                kwargs['cell_angles'] = self._cached_cell_angles
+            else:
+                vectors = state.getPeriodicBoxVectors(asNumpy=True)
+                vectors = vectors.value_in_unit(self._dist_unit)
+                a, b, c, alpha, beta, gamma = self._box_fn(*vectors)
+                #Tuples here; the writer thread boxes them into its
+                # reusable 3-float buffers.
+                kwargs['cell_lengths'] = (a, b, c)
+                kwargs['cell_angles'] = (alpha, beta, gamma)
+                if self.constantBox:
+                    self._cached_cell_lengths = kwargs['cell_lengths']
+                    self._cached_cell_angles = kwargs['cell_angles']
         if self._potentialEnergy:
             kwargs['potentialEnergy'] = state.getPotentialEnergy()
         if self._kineticEnergy:
             kwargs['kineticEnergy'] = state.getKineticEnergy()
         if self._temperature:
-            kwargs['temperature'] = 2 * state.getKineticEnergy() / (self._dof * unit.MOLAR_GAS_CONSTANT_R)
+            #Plain float in kelvin; write() stores it as-is
+            kwargs['temperature'] = self._temp_prefactor * state.getKineticEnergy().value_in_unit(
+                unit.kilojoules_per_mole)
         if self._velocities:
             kwargs['velocities'] = state.getVelocities(asNumpy=True)[self._atomSlice, :]
 
         #add a portion like this to store things other than the protocol work
-        if self._protocolWork:
-            protocol_work = simulation.integrator.get_protocol_work(dimensionless=True)
-            kwargs['protocolWork'] = np.array([protocol_work])
-        if self._alchemicalLambda:
-            kwargs['alchemicalLambda'] = np.array([simulation.integrator.getGlobalVariableByName('lambda')])
+        if self._protocolWork or self._alchemicalLambda:
+            protocol_work, alchemical_lambda = _fetch_alch_state(simulation.integrator, self._lambda_idx,
+                                                                 self._protocolWork, self._alchemicalLambda)
+            #The scalars are boxed into reusable arrays on the writer thread
+            if self._protocolWork:
+                kwargs['protocolWork'] = protocol_work
+            if self._alchemicalLambda:
+                kwargs['alchemicalLambda'] = alchemical_lambda
         if self._title:
             kwargs['title'] = self._title
         if self._parameters:
@@ -423,14 +571,98 @@ class BLUESHDF5Reporter(HDF5Reporter):
         if self._environment:
             kwargs['environment'] = self._environment
 
-        self._traj_file.write(*args, **kwargs)
-        # flush the file to disk. it might not be necessary to do this every
-        # report, but this is the most proactive solution. We don't want to
-        # accumulate a lot of data in memory only to find out, at the very
-        # end of the run, that there wasn't enough space on disk to hold the
-        # data.
-        if hasattr(self._traj_file, 'flush'):
-            self._traj_file.flush()
+        # Hand the snapshot to the writer thread so the next integration
+        # steps can overlap with HDF5 compression and disk writes.
+        if self._write_exc is not None:
+            raise self._write_exc
+        self._q.put((args, kwargs))
+
+    def _write_worker(self):
+        """Consume queued snapshots and write them to the HDF5 file."""
+        while True:
+            item = self._q.get()
+            try:
+                if item is self._SENTINEL:
+                    break
+                if self._write_exc is not None:
+                    # A previous write failed: keep consuming (and dropping)
+                    # frames so report() never blocks forever on a full
+                    # queue; the stored exception is re-raised over there.
+                    continue
+                args, kwargs = item
+                # Box the work/lambda scalars into the preallocated
+                # one-element buffers; write() copies them into the float32
+                # frame before the next iteration, so reuse is safe here.
+                if 'protocolWork' in kwargs:
+                    self._pw_buf[0] = kwargs['protocolWork']
+                    kwargs['protocolWork'] = self._pw_buf
+                if 'alchemicalLambda' in kwargs:
+                    self._al_buf[0] = kwargs['alchemicalLambda']
+                    kwargs['alchemicalLambda'] = self._al_buf
+                if 'cell_lengths' in kwargs:
+                    self._cl_buf[:] = kwargs['cell_lengths']
+                    kwargs['cell_lengths'] = self._cl_buf
+                    self._ca_buf[:] = kwargs['cell_angles']
+                    kwargs['cell_angles'] = self._ca_buf
+                self._traj_file.write(*args, **kwargs)
+                # Flushing the file to disk on every report forces a disk
+                # round-trip per frame, so let frames accumulate in the HDF5
+                # chunk cache and only flush every `flush_interval` reports
+                # (or every few seconds of wall time).
+                self._since_flush += 1
+                if (self._since_flush >= self._flush_interval
+                        or _monotonic() - self._last_flush > self._flush_timeout):
+                    self._flush()
+            except Exception as e:
+                # Surface the failure on the next report()/drain()/close()
+                # call instead of silently dropping frames.
+                self._write_exc = e
+            finally:
+                self._q.task_done()
+
+    def drain(self):
+        """Block until every queued frame has been written and flushed, so
+        the file on disk is complete and readable without closing it."""
+        if self._writer.is_alive():
+            self._q.join()
+        if self._write_exc is not None:
+            raise self._write_exc
+        self._flush()
+
+    def close(self):
+        """Drain the write queue, close the underlying trajectory file, and
+        re-raise any failure from the writer thread."""
+        atexit.unregister(self._atexit_hook)
+        if self._writer.is_alive():
+            self._q.put(self._SENTINEL)
+            self._writer.join()
+        self._flush()
+        super(BLUESHDF5Reporter, self).close()
+        if self._write_exc is not None:
+            exc, self._write_exc = self._write_exc, None
+            raise exc
+
+    def _flush(self):
+        """Flush any buffered frames to disk and reset the flush counters."""
+        traj_file = self._traj_file
+        if hasattr(traj_file, 'flush'):
+            try:
+                traj_file.flush()
+            except Exception:
+                # Only swallow the failure when the file is already closed
+                # (e.g. flushing from the atexit hook at interpreter exit);
+                # real I/O errors such as a full disk must propagate, so the
+                # worker surfaces them through _write_exc like write errors.
+                if getattr(traj_file, '_open', True):
+                    raise
+        self._since_flush = 0
+        self._last_flush = _monotonic()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            logging.getLogger(__name__).exception('Error closing trajectory reporter')
 
 
 class BLUESStateDataReporter(app.StateDataReporter):
@@ -524,12 +756,12 @@ class BLUESStateDataReporter(app.StateDataReporter):
         self.log = self._out
         self.title = title
 
-        self.frame_indices = frame_indices
         self._protocolWork, self._alchemicalLambda, self._currentIter = protocolWork, alchemicalLambda, currentIter
-        if self.frame_indices:
-            #If simulation.currentStep = 1, store the frame from the previous step.
-            # i.e. frame_indices=[1,100] will store the first and frame 100
-            self.frame_indices = [x - 1 for x in frame_indices]
+        #If simulation.currentStep = 1, store the frame from the previous step.
+        # i.e. frame_indices=[1,100] will store the first and frame 100
+        #A frozenset keeps the per-step membership test in
+        # describeNextReport O(1) instead of a linear scan of a list.
+        self.frame_indices = frozenset(x - 1 for x in frame_indices)
 
     def describeNextReport(self, simulation):
         """
@@ -580,24 +812,23 @@ class BLUESStateDataReporter(app.StateDataReporter):
                 self._out.flush()
             except AttributeError:
                 pass
+            #Precompute the line format so each report is a single C-level
+            # % substitution instead of a genexp str()-ing every column.
+            self._report_fmt = self.title.replace('%', '%%') + ': ' + self._separator.join(['%s'] * len(headers))
             self._initialClockTime = time.time()
             self._initialSimulationTime = state.getTime()
             self._initialSteps = simulation.currentStep
             self._hasInitialized = True
 
-        # Check for errors.
-        self._checkForErrors(simulation, state)
+        # Check for errors (only meaningful when energies were queried).
+        if self._needEnergy:
+            self._checkForErrors(simulation, state)
         # Query for the values
         values = self._constructReportValues(simulation, state)
 
-        # Write the values.
-        if hasattr(self.log, 'report'):
-            self.log.info = self.log.report
-        self.log.info('%s: %s' % (self.title, self._separator.join(str(v) for v in values)))
-        try:
-            self._out.flush()
-        except AttributeError:
-            pass
+        # Write the values. The logging handlers buffer and flush on their
+        # own schedule, so no per-report flush is needed here.
+        self.log.info(self._report_fmt % tuple(values))
 
     def _constructReportValues(self, simulation, state):
         """Query the simulation for the current state of our observables of interest.
@@ -752,8 +983,29 @@ class NetCDF4Reporter(parmed.openmm.reporters.NetCDFReporter):
         Write the protocolWork for the alchemical process in the NCMC simulation
     alchemicalLambda : bool=False,
         Write the alchemicalLambda step for the alchemical process in the NCMC simulation.
+    complevel : int=4
+        The zlib deflate level to apply to the coordinate/velocity/force
+        variables in the NetCDF file. 0 disables compression.
+    chunk_frames : int=None
+        The number of frames per chunk for the per-atom NetCDF variables.
+        Defaults to `writeBuffer` so each batched write fills whole chunks.
+    writeBuffer : int=1
+        The number of frames to accumulate in preallocated buffers before
+        writing them to the NetCDF file in one slice assignment per
+        variable. Larger batches amortize the per-frame NetCDF metadata
+        updates; partial batches are written when the reporter is closed.
+
+    Notes
+    -----
+    Frames are written to the NetCDF file from a background thread, so the
+    simulation does not stall on compression or disk I/O. Call `close()` (or
+    let the reporter be garbage collected) to drain any queued frames and
+    close the file.
     """
 
+    #Sentinel pushed onto the write queue to shut down the writer thread
+    _SENTINEL = object()
+
     def __init__(self,
                  file,
                  reportInterval=1,
@@ -762,17 +1014,36 @@ class NetCDF4Reporter(parmed.openmm.reporters.NetCDFReporter):
                  vels=False,
                  frcs=False,
                  protocolWork=False,
-                 alchemicalLambda=False):
+                 alchemicalLambda=False,
+                 complevel=4,
+                 chunk_frames=None,
+                 writeBuffer=1):
         """
         Create a NetCDFReporter instance.
         """
         super(NetCDF4Reporter, self).__init__(file, reportInterval, crds, vels, frcs)
         self.crds, self.vels, self.frcs, self.protocolWork, self.alchemicalLambda = crds, vels, frcs, protocolWork, alchemicalLambda
-        self.frame_indices = frame_indices
-        if self.frame_indices:
-            #If simulation.currentStep = 1, store the frame from the previous step.
-            # i.e. frame_indices=[1,100] will store the first and frame 100
-            self.frame_indices = [x - 1 for x in frame_indices]
+        self.writeBuffer = int(writeBuffer)
+        self.complevel = complevel
+        self.chunk_frames = int(chunk_frames) if chunk_frames else self.writeBuffer
+        self._lambda_idx = None
+        #Per-field frame buffers, allocated on the first frame once the
+        # atom count is known; _buffered counts the frames accumulated.
+        self._buffers = None
+        self._buffered = 0
+        #If simulation.currentStep = 1, store the frame from the previous step.
+        # i.e. frame_indices=[1,100] will store the first and frame 100
+        #A frozenset keeps the per-step membership test in
+        # describeNextReport O(1) instead of a linear scan of a list.
+        self.frame_indices = frozenset(x - 1 for x in frame_indices)
+
+        #Background writer thread, bounded so memory use stays fixed if the
+        # disk cannot keep up with the simulation (see BLUESHDF5Reporter).
+        self._q = queue.Queue(maxsize=16)
+        self._write_exc = None
+        self._writer = threading.Thread(target=self._write_worker, daemon=True)
+        self._writer.start()
+        self._atexit_hook = _register_atexit_close(self)
 
     def describeNextReport(self, simulation):
         """
@@ -813,24 +1084,32 @@ class NetCDF4Reporter(parmed.openmm.reporters.NetCDFReporter):
 
         """
         global VELUNIT, FRCUNIT
+        frame = {}
+        # asNumpy=True keeps the unit conversion inside NumPy instead of
+        # iterating over a Python list of Vec3s, which matters for large systems.
         if self.crds:
-            crds = state.getPositions().value_in_unit(u.angstrom)
+            frame['crds'] = state.getPositions(asNumpy=True).value_in_unit(u.angstrom)
         if self.vels:
-            vels = state.getVelocities().value_in_unit(VELUNIT)
+            frame['vels'] = state.getVelocities(asNumpy=True).value_in_unit(VELUNIT)
         if self.frcs:
-            frcs = state.getForces().value_in_unit(FRCUNIT)
-        if self.protocolWork:
-            protocolWork = simulation.integrator.get_protocol_work(dimensionless=True)
-        if self.alchemicalLambda:
-            alchemicalLambda = simulation.integrator.getGlobalVariableByName('lambda')
+            frame['frcs'] = state.getForces(asNumpy=True).value_in_unit(FRCUNIT)
+        if self.protocolWork or self.alchemicalLambda:
+            if self.alchemicalLambda and self._lambda_idx is None:
+                self._lambda_idx = _lambda_index(simulation.integrator)
+            protocol_work, alchemical_lambda = _fetch_alch_state(simulation.integrator, self._lambda_idx,
+                                                                 self.protocolWork, self.alchemicalLambda)
+            if self.protocolWork:
+                frame['protocolWork'] = protocol_work
+            if self.alchemicalLambda:
+                frame['alchemicalLambda'] = alchemical_lambda
         if self._out is None:
             # This must be the first frame, so set up the trajectory now
             if self.crds:
-                atom = len(crds)
+                atom = len(frame['crds'])
             elif self.vels:
-                atom = len(vels)
+                atom = len(frame['vels'])
             elif self.frcs:
-                atom = len(frcs)
+                atom = len(frame['frcs'])
             self.uses_pbc = simulation.topology.getUnitCellDimensions() is not None
             self._out = NetCDF4Traj.open_new(
                 self.fname,
@@ -842,24 +1121,131 @@ class NetCDF4Reporter(parmed.openmm.reporters.NetCDFReporter):
                 title="ParmEd-created trajectory using OpenMM",
                 protocolWork=self.protocolWork,
                 alchemicalLambda=self.alchemicalLambda,
+                complevel=self.complevel,
+                chunk_frames=self.chunk_frames,
             )
 
         if self.uses_pbc:
             vecs = state.getPeriodicBoxVectors()
             lengths, angles = box_vectors_to_lengths_and_angles(*vecs)
-            self._out.add_cell_lengths_angles(lengths.value_in_unit(u.angstrom), angles.value_in_unit(u.degree))
+            frame['cell_lengths'] = lengths.value_in_unit(u.angstrom)
+            frame['cell_angles'] = angles.value_in_unit(u.degree)
+
+        frame['time'] = state.getTime().value_in_unit(u.picosecond)
+
+        # Hand the frame to the writer thread so the next integration steps
+        # can overlap with the NetCDF writes.
+        if self._write_exc is not None:
+            raise self._write_exc
+        self._q.put(frame)
 
-        # Add the coordinates, velocities, and/or forces as needed
+    def _write_worker(self):
+        """Consume queued frames, batch them, and write them to the NetCDF file."""
+        while True:
+            frame = self._q.get()
+            try:
+                if frame is self._SENTINEL:
+                    break
+                if self._write_exc is not None:
+                    # A previous write failed: keep consuming (and dropping)
+                    # frames so report() never blocks forever on a full
+                    # queue; the stored exception is re-raised over there.
+                    continue
+                self._buffer_frame(frame)
+                if self._buffered >= self.writeBuffer:
+                    self._write_batch()
+            except Exception as e:
+                # Surface the failure on the next report()/drain()/close()
+                # call instead of silently dropping frames.
+                self._write_exc = e
+            finally:
+                self._q.task_done()
+
+    def _buffer_frame(self, frame):
+        """Copy one frame of data into the preallocated write buffers."""
+        if self._buffers is None:
+            natom = self._out.atom
+            shape = (self.writeBuffer, natom, 3)
+            buf = {}
+            if self.crds:
+                buf['crds'] = np.empty(shape, dtype=np.float32)
+            if self.vels:
+                buf['vels'] = np.empty(shape, dtype=np.float32)
+            if self.frcs:
+                buf['frcs'] = np.empty(shape, dtype=np.float32)
+            if self.uses_pbc:
+                buf['cell_lengths'] = np.empty((self.writeBuffer, 3))
+                buf['cell_angles'] = np.empty((self.writeBuffer, 3))
+            if self.protocolWork:
+                buf['protocolWork'] = np.empty(self.writeBuffer, dtype=np.float32)
+            if self.alchemicalLambda:
+                buf['alchemicalLambda'] = np.empty(self.writeBuffer, dtype=np.float32)
+            buf['time'] = np.empty(self.writeBuffer)
+            self._buffers = buf
+        buf = self._buffers
+        i = self._buffered
         if self.crds:
-            self._out.add_coordinates(crds)
+            buf['crds'][i] = frame['crds']
         if self.vels:
-            # The velocities get scaled right before writing
-            self._out.add_velocities(vels)
+            buf['vels'][i] = frame['vels']
         if self.frcs:
-            self._out.add_forces(frcs)
+            buf['frcs'][i] = frame['frcs']
+        if self.uses_pbc:
+            buf['cell_lengths'][i] = frame['cell_lengths']
+            buf['cell_angles'][i] = frame['cell_angles']
         if self.protocolWork:
-            self._out.add_protocolWork(protocolWork)
+            buf['protocolWork'][i] = frame['protocolWork']
         if self.alchemicalLambda:
-            self._out.add_alchemicalLambda(alchemicalLambda)
-        # Now it's time to add the time.
-        self._out.add_time(state.getTime().value_in_unit(u.picosecond))
+            buf['alchemicalLambda'][i] = frame['alchemicalLambda']
+        buf['time'][i] = frame['time']
+        self._buffered = i + 1
+
+    def _write_batch(self):
+        """Write the buffered frames in one slice assignment per variable."""
+        n = self._buffered
+        if not n or self._out is None:
+            return
+        buf = self._buffers
+        self._out.add_frames(
+            crds=buf['crds'][:n] if self.crds else None,
+            vels=buf['vels'][:n] if self.vels else None,
+            frcs=buf['frcs'][:n] if self.frcs else None,
+            cell_lengths=buf['cell_lengths'][:n] if self.uses_pbc else None,
+            cell_angles=buf['cell_angles'][:n] if self.uses_pbc else None,
+            times=buf['time'][:n],
+            protocolWork=buf['protocolWork'][:n] if self.protocolWork else None,
+            alchemicalLambda=buf['alchemicalLambda'][:n] if self.alchemicalLambda else None)
+        self._buffered = 0
+
+    def drain(self):
+        """Block until every queued frame, including any partial batch, has
+        been written, so the file on disk is complete and readable without
+        closing it."""
+        if self._writer.is_alive():
+            self._q.join()
+        if self._write_exc is not None:
+            raise self._write_exc
+        #The worker is idle once the queue is joined, so writing the
+        # partial batch from this thread is safe.
+        self._write_batch()
+
+    def close(self):
+        """Drain the write queue, close the underlying trajectory file, and
+        re-raise any failure from the writer thread."""
+        atexit.unregister(self._atexit_hook)
+        if self._writer.is_alive():
+            self._q.put(self._SENTINEL)
+            self._writer.join()
+        if self._write_exc is None:
+            self._write_batch()
+        if self._out is not None and not getattr(self._out, 'closed', False):
+            self._out.close()
+        if self._write_exc is not None:
+            exc, self._write_exc = self._write_exc, None
+            raise exc
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            logging.getLogger(__name__).exception('Error closing trajectory reporter')
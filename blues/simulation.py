@@ -1212,6 +1212,17 @@ class BLUESSimulation(object):
                                           'MD-fail-it%s-md%i.pdb' % (self.currentIter, self._md_sim.currentStep))
                 sys.exit(1)
 
+    def _drainReporters(self):
+        """Block until reporters with queued or buffered trajectory frames
+        (e.g. `NetCDF4Reporter`, `BLUESHDF5Reporter`) have written them to
+        disk, so the files are complete and readable once `run()` returns.
+        """
+        for sim in (self._md_sim, self._ncmc_sim):
+            for reporter in sim.reporters:
+                drain = getattr(reporter, 'drain', None)
+                if drain is not None:
+                    drain()
+
     def run(self, nIter=0, nstepsNC=0, moveStep=0, nstepsMD=0, temperature=300, write_move=False, **config):
         """Executes the BLUES engine to iterate over the actions:
         Perform NCMC simulation, perform proposed move, accepts/rejects move,
@@ -1252,6 +1263,7 @@ class BLUESSimulation(object):
             self._stepMD(nstepsMD)
 
         # END OF NITER
+        self._drainReporters()
         self.acceptRatio = self.accept / float(nIter)
         logger.info('Acceptance Ratio: %s' % self.acceptRatio)
         logger.info('nIter: %s ' % nIter)
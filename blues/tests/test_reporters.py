@@ -0,0 +1,173 @@
+import pytest
+import numpy as np
+from simtk import unit
+from simtk.openmm import app
+
+from blues.formats import BLUESHDF5TrajectoryFile, NetCDF4Traj
+from blues.reporters import BLUESHDF5Reporter, BLUESStateDataReporter, NetCDF4Reporter
+
+
+class _FakeState:
+    """Stand-in for simtk.openmm.State with just what the reporters query."""
+
+    def __init__(self, natom):
+        self._natom = natom
+
+    def getPositions(self, asNumpy=False):
+        return unit.Quantity(np.random.random((self._natom, 3)), unit.nanometers)
+
+    def getTime(self):
+        return 1.0 * unit.picoseconds
+
+
+class _FakeSystem:
+    def __init__(self, natom):
+        self._natom = natom
+
+    def getNumParticles(self):
+        return self._natom
+
+    def getParticleMass(self, index):
+        return 12.0 * unit.dalton
+
+    def getNumConstraints(self):
+        return 0
+
+
+class _FakeSimulation:
+    def __init__(self, topology, natom):
+        self.topology = topology
+        self.system = _FakeSystem(natom)
+        self.currentStep = 0
+
+
+class _FakeTopology:
+    """Minimal topology for the NetCDF reporter (no periodic box)."""
+
+    def getUnitCellDimensions(self):
+        return None
+
+
+def _carbon_topology(natom):
+    topology = app.Topology()
+    chain = topology.addChain()
+    residue = topology.addResidue('CRB', chain)
+    for i in range(natom):
+        topology.addAtom('C%d' % i, app.element.carbon, residue)
+    return topology
+
+
+def test_hdf5_reporter_flush_interval_and_close(tmpdir):
+    """Frames should accumulate between flushes and all hit the disk on close."""
+    tables = pytest.importorskip('tables')
+    fname = str(tmpdir.join('traj.h5'))
+    natom = 10
+    reporter = BLUESHDF5Reporter(
+        fname,
+        reportInterval=1,
+        cell=False,
+        protocolWork=False,
+        alchemicalLambda=False,
+        environment=False,
+        flush_interval=2)
+    simulation = _FakeSimulation(_carbon_topology(natom), natom)
+    state = _FakeState(natom)
+    for _ in range(5):
+        reporter.report(simulation, state)
+    reporter._q.join()
+    #Flushes fired after frames 2 and 4, leaving one unflushed report
+    assert reporter._since_flush == 1
+    reporter.close()
+    assert not reporter._writer.is_alive()
+    with tables.open_file(fname) as handle:
+        assert handle.root.coordinates.shape == (5, natom, 3)
+
+
+def test_reporter_frame_indices_frozenset(tmpdir):
+    """Every reporter should shift frame_indices by one and store them as a
+    frozenset for O(1) membership tests in describeNextReport."""
+    import logging
+    frame_indices = [1, 100]
+    expected = frozenset([0, 99])
+
+    hdf5 = BLUESHDF5Reporter(str(tmpdir.join('fi.h5')), frame_indices=frame_indices, environment=False)
+    assert hdf5.frame_indices == expected
+    hdf5.close()
+
+    netcdf = NetCDF4Reporter(str(tmpdir.join('fi.nc')), frame_indices=frame_indices)
+    assert netcdf.frame_indices == expected
+    netcdf.close()
+
+    state = BLUESStateDataReporter(logging.getLogger(__name__), frame_indices=frame_indices)
+    assert state.frame_indices == expected
+
+
+def test_netcdf4_reporter_batched_write_and_drain(tmpdir):
+    """Full batches are written by the worker; drain() writes the partial
+    batch so the file is complete without closing the reporter."""
+    netCDF4 = pytest.importorskip('netCDF4')
+    fname = str(tmpdir.join('traj.nc'))
+    natom = 10
+    reporter = NetCDF4Reporter(fname, reportInterval=1, writeBuffer=3)
+    simulation = _FakeSimulation(_FakeTopology(), natom)
+    state = _FakeState(natom)
+    for _ in range(5):
+        reporter.report(simulation, state)
+    reporter._q.join()
+    #One full batch written, two frames still buffered
+    assert reporter._out._last_crd_frame == 3
+    assert reporter._buffered == 2
+    reporter.drain()
+    assert reporter._out._last_crd_frame == 5
+    assert reporter._buffered == 0
+    reporter.close()
+    assert not reporter._writer.is_alive()
+    with netCDF4.Dataset(fname) as ncfile:
+        assert ncfile.variables['coordinates'].shape == (5, natom, 3)
+
+
+def test_hdf5_trajectory_rejects_ragged_frames(tmpdir):
+    """Later frames must carry exactly the fields the file was created with,
+    on the fast append path just like on the first write."""
+    pytest.importorskip('tables')
+    fname = str(tmpdir.join('ragged.h5'))
+    traj = BLUESHDF5TrajectoryFile(fname, 'w')
+    coordinates = np.random.random((1, 5, 3)).astype(np.float32)
+    traj.write(coordinates, time=np.zeros(1))
+    traj.write(coordinates, time=np.ones(1))
+    with pytest.raises(ValueError):
+        #time was written for earlier frames, so omitting it is ragged
+        traj.write(coordinates)
+    with pytest.raises(ValueError):
+        #the file was not created with a temperature field
+        traj.write(coordinates, time=np.zeros(1), temperature=np.zeros(1))
+    with pytest.raises(ValueError):
+        #time must cover the same number of frames as coordinates
+        traj.write(coordinates, time=np.zeros(2))
+    traj.close()
+
+
+def test_netcdf4_traj_deflate(tmpdir):
+    """Coordinates should be written deflated when the backend supports it."""
+    fname = str(tmpdir.join('compressed.nc'))
+    traj = NetCDF4Traj.open_new(fname, 10, box=False, crds=True, vels=False, frcs=False)
+    ncfile = traj._ncfile
+    if getattr(ncfile, 'data_model', '') != 'NETCDF4':
+        traj.close()
+        pytest.skip('NetCDF backend/data model does not support compression filters')
+    filters = ncfile['coordinates'].filters()
+    assert filters['zlib']
+    assert filters['complevel'] == 4
+    traj.add_frames(crds=np.zeros((1, 10, 3), dtype=np.float32), times=np.zeros(1))
+    assert ncfile['coordinates'].shape[0] == 1
+    traj.close()
+
+
+def test_netcdf4_traj_no_deflate(tmpdir):
+    """complevel=0 should fall back to the plain uncompressed layout."""
+    fname = str(tmpdir.join('uncompressed.nc'))
+    traj = NetCDF4Traj.open_new(fname, 10, box=False, crds=True, vels=False, frcs=False, complevel=0)
+    ncfile = traj._ncfile
+    if getattr(ncfile, 'data_model', '') == 'NETCDF4':
+        assert not ncfile['coordinates'].filters()['zlib']
+    traj.close()
@@ -8,9 +8,11 @@ Contributors: Nathan M. Lim, David L. Mobley
 import logging
 import os
 import sys
+from functools import lru_cache
 from math import ceil, floor
 from platform import uname
 
+import numpy as np
 import parmed
 from simtk import openmm, unit
 
@@ -227,26 +229,31 @@ def atomIndexfromTop(resname, topology):
 
     Arguments
     ---------
-    resname: str
-        resname that you want to get the atom indicies for (ex. 'LIG')
+    resname: str or iterable of str
+        resname(s) that you want to get the atom indicies for (ex. 'LIG')
     topology: str, optional, default=None
         path of topology file. Include if the topology is not included
         in the coord_file
 
     Returns
     -------
-    lig_atoms : list of ints
-        list of atoms in the coordinate file matching lig_resname
+    lig_atoms : np.ndarray of ints
+        array of atoms in the coordinate file matching lig_resname, suitable
+        for fancy-indexing into position/velocity arrays
     """
-    lig_atoms = []
-    for atom in topology.atoms():
-        if str(resname) in atom.residue.name:
-            lig_atoms.append(atom.index)
-    return lig_atoms
+    # Exact set membership instead of a per-atom substring test: O(1) per
+    # atom, and 'LIG' no longer spuriously matches residues such as 'GLIG'.
+    names = {resname} if isinstance(resname, str) else set(resname)
+    # np.fromiter avoids boxing each index as a Python int and the repeated
+    # list.append resizing on large topologies.
+    return np.fromiter((atom.index for atom in topology.atoms() if atom.residue.name in names), dtype=np.intp)
 
 
+@lru_cache(maxsize=None)
 def get_data_filename(package_root, relative_path):
     """Get the full path to one of the reference files in testsystems.
+    The resolved path is cached, so repeated lookups of the same file skip
+    the pkg_resources filesystem walk.
     In the source distribution, these files are in ``blues/data/``,
     but on installation, they're moved to somewhere in the user's python
     site-packages directory.